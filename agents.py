@@ -2,7 +2,9 @@
 Agent definitions and system prompts for the Equity Research Agent system.
 """
 
-from typing import TypedDict
+from typing import Literal, TypedDict
+
+from pydantic import BaseModel, Field
 
 
 # Agent System Prompts
@@ -65,6 +67,89 @@ Your memo should include:
 
 Be decisive but acknowledge uncertainty where it exists."""
 
+COMBINED_PROMPT = f"""You will act as three specialists in sequence and answer in a single response.
+
+=== ROLE 1: FUNDAMENTAL ===
+{FUNDAMENTALIST_PROMPT}
+
+=== ROLE 2: QUANT ===
+{QUANT_PROMPT}
+
+=== ROLE 3: MEMO ===
+{STRATEGIST_PROMPT}
+In this role, the two specialist analyses are the FUNDAMENTAL and QUANT sections you have just written.
+
+Format your response as exactly three sections, in this order, each starting with its header on its own line:
+### FUNDAMENTAL
+### QUANT
+### MEMO"""
+
+
+# Per-call message templates
+# Built once at import time; only the dynamic fields are filled per call, so
+# the text around them stays byte-identical across invocations.
+FUNDAMENTALIST_TEMPLATE = """Here is the market data for {ticker}:
+
+{market_data}
+
+Provide your fundamental analysis:"""
+
+QUANT_TEMPLATE = """Here is the peer comparison data for {ticker}:
+
+{market_data}
+
+Provide your quantitative analysis:"""
+
+STRATEGIST_TEMPLATE = """You are analyzing: {ticker}
+
+=== FUNDAMENTAL ANALYST'S REPORT ===
+{fundamentalist_analysis}
+
+=== QUANTITATIVE ANALYST'S REPORT ===
+{quant_analysis}
+
+=== YOUR TASK ===
+Synthesize the above analyses into a final investment memo with a clear BUY/SELL/HOLD recommendation.
+"""
+
+COMBINED_TEMPLATE = """Here is the market data and peer comparison for {ticker}:
+
+{market_data}
+
+Provide your three sections:"""
+
+
+# Structured Strategist Output
+class InvestmentMemo(BaseModel):
+    """Final investment memo, produced via schema-guided decoding."""
+
+    executive_summary: str = Field(description="One-paragraph executive summary")
+    evidence: list[str] = Field(description="2-3 key supporting evidence bullet points")
+    risks: list[str] = Field(description="2-3 key risks or concerns")
+    recommendation: Literal["BUY", "SELL", "HOLD"] = Field(description="Final recommendation")
+    conviction: Literal["Low", "Medium", "High"] = Field(description="Conviction level")
+
+
+def render_memo(memo: dict) -> str:
+    """
+    Render a structured investment memo as text for CLI display.
+
+    Args:
+        memo: InvestmentMemo fields as a dict
+
+    Returns:
+        Formatted memo string
+    """
+    evidence = "\n".join(f"- {item}" for item in memo['evidence'])
+    risks = "\n".join(f"- {item}" for item in memo['risks'])
+    return (
+        f"Executive Summary:\n{memo['executive_summary']}\n\n"
+        f"Key Supporting Evidence:\n{evidence}\n\n"
+        f"Key Risks/Concerns:\n{risks}\n\n"
+        f"Recommendation: **{memo['recommendation']}**\n"
+        f"Conviction: {memo['conviction']}"
+    )
+
 
 # State Definition for LangGraph
 class AgentState(TypedDict):
@@ -77,9 +162,11 @@ class AgentState(TypedDict):
         fundamentalist_analysis: Analysis from the fundamentalist agent
         quant_analysis: Analysis from the quant agent
         final_report: Synthesized report from the strategist
+        memo: Structured InvestmentMemo fields (empty unless STRUCTURED_MEMO)
     """
     ticker: str
     market_data: str
     fundamentalist_analysis: str
     quant_analysis: str
     final_report: str
+    memo: dict
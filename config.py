@@ -1,19 +1,57 @@
 """
 Configuration file for the Equity Research Agent system.
 
-Switch between 'ollama' (local, requires ~2-7GB storage) and 'openai' (API-based, no storage).
+Switch between 'ollama' (local, requires ~2-7GB storage), 'openai' (API-based, no storage)
+and 'vllm' (self-hosted OpenAI-compatible server with continuous batching).
 """
 
 # LLM Model Selection
-# Options: 'ollama' or 'openai'
+# Options: 'ollama', 'openai' or 'vllm'
 # Note: 'ollama' requires local model download (~2-7GB)
 # 'openai' requires API key in environment variable OPENAI_API_KEY
+# 'vllm' requires a running vLLM server at VLLM_BASE_URL
 LLM_MODEL = 'ollama'
 
 # OpenAI Configuration
 OPENAI_MODEL = 'gpt-4o-mini'
 OPENAI_TEMPERATURE = 0
+# Smaller model used only for peer selection (JSON-schema constrained output)
+OPENAI_PEERS_MODEL = 'gpt-4o-mini'
 
 # Ollama Configuration
-OLLAMA_MODEL = 'llama3.2'
+# 'llama3.2:3b-instruct-q4_K_M' is the same Q4_K_M build Ollama's plain 'llama3.2' tag
+# points to; it is named explicitly so OLLAMA_QUANTIZED = False can switch to the
+# fp16 build (e.g. to compare output quality).
+OLLAMA_QUANTIZED = True
+OLLAMA_MODEL = 'llama3.2:3b-instruct-q4_K_M' if OLLAMA_QUANTIZED else 'llama3.2:3b-instruct-fp16'
 OLLAMA_TEMPERATURE = 0
+# Smaller model used only for peer selection (JSON-schema constrained output)
+OLLAMA_PEERS_MODEL = 'llama3.2:1b'
+
+# vLLM Configuration
+# Start the server with (the 1B draft model enables speculative decoding):
+#   python -m vllm.entrypoints.openai.api_server \
+#       --model meta-llama/Llama-3.2-3B-Instruct --enable-prefix-caching \
+#       --speculative-config '{"model": "meta-llama/Llama-3.2-1B-Instruct", "num_speculative_tokens": 5}'
+VLLM_BASE_URL = 'http://localhost:8000/v1'
+VLLM_MODEL = 'meta-llama/Llama-3.2-3B-Instruct'
+# Keep at 0: greedy decoding maximizes speculative draft acceptance
+VLLM_TEMPERATURE = 0
+
+# Portfolio Mode
+# Multi-ticker runs are grouped by market cap (large caps tend to get longer
+# memos) and each group runs as its own batch with a generation cap, so short
+# analyses don't wait behind long ones. One entry per bin, smallest caps first.
+# Portfolios with fewer than two tickers per bin skip binning and run at once.
+PORTFOLIO_BIN_MAX_TOKENS = [512, 768, 1024]
+
+# Graph Configuration
+# When True, the fundamentalist, quant and strategist roles run as one LLM call
+# (research -> combined) instead of three (research -> fundamentalist & quant -> strategist)
+FUSE_ANALYST_CALLS = False
+
+# When True, the strategist returns a schema-validated InvestmentMemo (stored in
+# state['memo'] and rendered into final_report) instead of free-form prose.
+# Structured memos are printed once complete rather than streamed.
+# Not supported together with FUSE_ANALYST_CALLS (create_graph raises ValueError).
+STRUCTURED_MEMO = False
@@ -1,39 +1,75 @@
 """
 Data fetching and analysis tools for the Equity Research Agent system.
-Implements yfinance best practices with rate-limited sessions.
+Implements yfinance best practices with rate-limited requests.
 """
 
+import json
+import os
+import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import yfinance as yf
+from yfinance.data import YfData
 from datetime import datetime, timedelta
 from utils import get_llm
 from langchain_core.messages import HumanMessage
 
 # Import rate limiting components
-from requests import Session
-from requests_cache import CacheMixin, SQLiteCache
-from requests_ratelimiter import LimiterMixin, MemoryQueueBucket
 from pyrate_limiter import Duration, RequestRate, Limiter
 
 
-# Create a rate-limited session class
-class CachedLimiterSession(CacheMixin, LimiterMixin, Session):
-    """Session with caching and rate limiting to avoid Yahoo Finance blocks."""
-    pass
-
-
-# Create global session with strict rate limiting
+# Shared limiter for all Yahoo Finance traffic
 # Max 2 requests per 5 seconds (Yahoo Finance recommended limit)
-_session = CachedLimiterSession(
-    limiter=Limiter(RequestRate(2, Duration.SECOND * 5)),
-    bucket_class=MemoryQueueBucket,
-    backend=SQLiteCache("yfinance.cache"),
-)
+_limiter = Limiter(RequestRate(2, Duration.SECOND * 5))
+
+# Ticker-like tokens: validates JSON peers and extracts them from free-form replies
+_TICKER_RE = re.compile(r"\b[A-Z]{1,5}\b")
+
+# Peer selections are memoized on disk so the LLM is asked once per ticker
+PEERS_CACHE_FILE = "peers_cache.json"
+PEERS_CACHE_TTL = timedelta(days=30)
+_peer_cache = None
+# research_node runs in executor threads, one per concurrently analyzed ticker
+_peer_cache_lock = threading.Lock()
+
+# Parsed quotes are reused for 15 minutes (in memory, per process)
+QUOTE_CACHE_TTL = timedelta(minutes=15)
+_quote_cache = {}
+_quote_cache_lock = threading.Lock()
+
+# Separator line for the peer comparison summary
+_BAR = "=" * 60
+
+# Batched quote endpoint (accepts comma-separated symbols)
+YAHOO_QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+# Only the fields _parse_ticker_info reads, to keep the response small.
+# The quote payload has no pegRatio, so PEG is derived from the EPS fields.
+YAHOO_QUOTE_FIELDS = [
+    'regularMarketPrice',
+    'marketCap',
+    'trailingPE',
+    'forwardPE',
+    'priceToBook',
+    'epsTrailingTwelveMonths',
+    'epsForward'
+]
+# Quote entries without these are refetched individually. marketCap is not
+# required: ETFs (e.g. the SPY/QQQ/DIA fallback peers) never report one.
+_REQUIRED_QUOTE_FIELDS = ('regularMarketPrice',)
+
+# Per-ticker fallback: thread cap per fetch_quotes call, and retries after a
+# 429 with a short doubling wait (2s, 4s); all calls are still gated by _limiter
+_MAX_FETCH_WORKERS = 4
+_RATE_LIMIT_RETRIES = 2
+_RATE_LIMIT_BACKOFF_SECONDS = 2
 
 
 def get_peers(ticker: str) -> list[str]:
     """
     Use LLM to generate a list of 3 competitor tickers for the given ticker.
+    Results are cached in PEERS_CACHE_FILE and reused until PEERS_CACHE_TTL expires.
 
     Args:
         ticker: Stock ticker symbol (e.g., 'AAPL')
@@ -45,41 +81,145 @@ def get_peers(ticker: str) -> list[str]:
         >>> get_peers('AAPL')
         ['MSFT', 'GOOGL', 'META']
     """
-    llm = get_llm()
+    ticker = ticker.upper()
+
+    cached = _get_cached_peers(ticker)
+    if cached:
+        return cached
+
+    llm = get_llm(role='peers')
 
     prompt = f"""You are a financial analyst. Given the stock ticker '{ticker}',
-return ONLY a Python list of exactly 3 competitor ticker symbols.
-Return ONLY the list, nothing else. Format: ['TICKER1', 'TICKER2', 'TICKER3']
+return ONLY a JSON object listing exactly 3 competitor ticker symbols.
+Return ONLY the JSON, nothing else. Format: {{"peers": ["TICKER1", "TICKER2", "TICKER3"]}}
 
-Example for AAPL: ['MSFT', 'GOOGL', 'META']
+Example for AAPL: {{"peers": ["MSFT", "GOOGL", "META"]}}
 
 Now provide 3 competitors for {ticker}:"""
 
     response = llm.invoke([HumanMessage(content=prompt)])
 
-    # Parse the response - it should be a string representation of a list
+    peers = _parse_peers(response.content, exclude=ticker)
+    if peers:
+        # Only schema-shaped answers are persisted; a regex guess is used for
+        # this run but the LLM is asked again next time
+        _store_cached_peers(ticker, peers)
+        return peers
+
+    peers = _guess_peers(response.content, exclude=ticker)
+    if peers:
+        return peers
+
+    # Fallback: return some generic large-cap tech stocks
+    print(f"Warning: Could not parse peers for {ticker}, using fallback")
+    return ['SPY', 'QQQ', 'DIA']  # Market ETFs as safe fallback
+
+
+def _parse_peers(text: str, exclude: str = '') -> list[str] | None:
+    """
+    Parse a JSON peer response into a list of 3 ticker symbols.
+
+    Accepts either a bare array or the {"peers": [...]} object produced by the
+    peers model (after normalising single quotes). Every entry must look like a
+    ticker, be distinct and differ from the ticker being analyzed.
+
+    Args:
+        text: Raw LLM response content
+        exclude: The ticker being analyzed (not a valid peer of itself)
+
+    Returns:
+        List of 3 upper-case tickers, or None if the response is not valid
+    """
     try:
-        # Clean the response and evaluate as Python literal
-        peers_str = response.content.strip()
-        # Use eval safely since we expect a list format
-        peers = eval(peers_str)
-
-        # Validate we got a list of 3 strings
-        if isinstance(peers, list) and len(peers) == 3:
-            return [str(p).upper() for p in peers]
-        else:
-            # Fallback: try to extract tickers from response
-            raise ValueError("Invalid peer format")
-    except:
-        # Fallback: return some generic large-cap tech stocks
-        print(f"Warning: Could not parse peers for {ticker}, using fallback")
-        return ['SPY', 'QQQ', 'DIA']  # Market ETFs as safe fallback
+        peers = json.loads(text.strip().replace("'", '"'))
+    except ValueError:
+        return None
+
+    if isinstance(peers, dict):
+        peers = peers.get('peers')
+    if not isinstance(peers, list) or len(peers) != 3:
+        return None
+
+    peers = [str(p).strip().upper() for p in peers]
+    if not all(_TICKER_RE.fullmatch(p) for p in peers):
+        return None
+    if len(set(peers)) != 3 or exclude.upper() in peers:
+        return None
+    return peers
+
+
+def _guess_peers(text: str, exclude: str = '') -> list[str] | None:
+    """
+    Extract 3 peer tickers from a free-form LLM response.
+
+    Fallback for responses that are not valid JSON: takes the first three
+    distinct upper-case ticker-like tokens other than the analyzed ticker.
+
+    Args:
+        text: Raw LLM response content
+        exclude: The ticker being analyzed (dropped from the matches)
+
+    Returns:
+        List of 3 upper-case tickers, or None if fewer than 3 were found
+    """
+    candidates = [t for t in _TICKER_RE.findall(text) if t != exclude.upper()]
+    peers = list(dict.fromkeys(candidates))[:3]
+    return peers if len(peers) == 3 else None
+
+
+def _load_peer_cache() -> dict:
+    """Load the on-disk peer cache once per process (caller holds _peer_cache_lock)."""
+    global _peer_cache
+    if _peer_cache is None:
+        try:
+            with open(PEERS_CACHE_FILE) as f:
+                _peer_cache = json.load(f)
+        except (OSError, ValueError):
+            _peer_cache = {}
+    return _peer_cache
+
+
+def _get_cached_peers(ticker: str) -> list[str] | None:
+    """Return cached peers for a ticker, or None if missing or expired."""
+    with _peer_cache_lock:
+        entry = _load_peer_cache().get(ticker)
+    if not entry:
+        return None
+
+    try:
+        fetched_at = datetime.fromisoformat(entry['fetched_at'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    if datetime.now() - fetched_at > PEERS_CACHE_TTL:
+        return None
+    return entry.get('peers')
+
+
+def _store_cached_peers(ticker: str, peers: list[str]) -> None:
+    """Record peers for a ticker and persist the cache to disk atomically."""
+    with _peer_cache_lock:
+        cache = _load_peer_cache()
+        cache[ticker] = {
+            'peers': peers,
+            'fetched_at': datetime.now().isoformat()
+        }
+        snapshot = dict(cache)
+
+        # Write to a temp file and swap it in, so readers never see a partial file
+        tmp_path = f"{PEERS_CACHE_FILE}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(tmp_path, PEERS_CACHE_FILE)
+        except OSError as e:
+            print(f"Warning: Could not write peer cache: {e}")
 
 
 def fetch_market_data(ticker: str) -> dict:
     """
     Fetch key financial metrics for a ticker and its peers using yfinance.
-    Uses generous delays between requests to avoid 429 errors.
+    All symbols are requested in a single batched quote call.
 
     Args:
         ticker: Stock ticker symbol (e.g., 'AAPL')
@@ -102,40 +242,8 @@ def fetch_market_data(ticker: str) -> dict:
     all_tickers = [ticker] + peers
 
     print(f"Fetching data for {ticker} and peers: {', '.join(peers)}")
-    print("Using conservative rate limiting (15 second delay between requests)...")
 
-    # Fetch data with generous delays
-    results = {}
-    for idx, t in enumerate(all_tickers):
-        print(f"  Fetching {t}...", end=" ", flush=True)
-        try:
-            # Let yfinance handle its own session (no custom session parameter)
-            ticker_obj = yf.Ticker(t)
-            info = ticker_obj.info
-            results[t] = _parse_ticker_info(t, info)
-            print("✓")
-
-            # Add generous delay between requests (skip delay after last ticker)
-            if idx < len(all_tickers) - 1:
-                print(f"  Waiting 15 seconds before next request...", end=" ", flush=True)
-                time.sleep(15)
-                print("✓")
-        except Exception as e:
-            if "429" in str(e) or "Too Many Requests" in str(e):
-                print(f"\n  ⚠️  Rate limited on {t}. Waiting 120 seconds...")
-                time.sleep(120)
-                # Retry once after waiting
-                try:
-                    ticker_obj = yf.Ticker(t)
-                    info = ticker_obj.info
-                    results[t] = _parse_ticker_info(t, info)
-                    print("  ✓ Retry successful")
-                except:
-                    print(f"  ✗ Failed after retry")
-                    results[t] = _get_empty_ticker_data(t)
-            else:
-                print(f"✗ Error: {e}")
-                results[t] = _get_empty_ticker_data(t)
+    results = fetch_quotes(all_tickers)
 
     # Organize results
     main_data = results.get(ticker, _get_empty_ticker_data(ticker))
@@ -148,13 +256,120 @@ def fetch_market_data(ticker: str) -> dict:
     }
 
 
+def fetch_quotes(tickers: list[str]) -> dict:
+    """
+    Fetch quote data for several tickers in one HTTP round-trip.
+
+    Yahoo's quote endpoint accepts a comma-separated list of symbols, so
+    the whole peer group costs a single request. The request goes through
+    yfinance's data fetcher, which performs Yahoo's cookie/crumb handshake,
+    and is throttled by the shared limiter. Any tickers missing from the
+    batched response are fetched individually in parallel.
+
+    Successful results are kept for QUOTE_CACHE_TTL, so a ticker fetched
+    earlier in the session (e.g. for portfolio binning) is not fetched again.
+
+    Args:
+        tickers: List of ticker symbols
+
+    Returns:
+        Dictionary of ticker -> parsed metrics (see _parse_ticker_info).
+        Tickers that could not be fetched map to empty ticker data.
+    """
+    now = datetime.now()
+    results = {}
+    with _quote_cache_lock:
+        for t in tickers:
+            cached = _quote_cache.get(t)
+            if cached and now - cached[0] <= QUOTE_CACHE_TTL:
+                results[t] = cached[1]
+
+    to_fetch = [t for t in tickers if t not in results]
+    if to_fetch:
+        fetched = _fetch_quotes_uncached(to_fetch)
+        with _quote_cache_lock:
+            for t, data in fetched.items():
+                if 'error' not in data:
+                    _quote_cache[t] = (now, data)
+        results.update(fetched)
+
+    return results
+
+
+def _fetch_quotes_uncached(tickers: list[str]) -> dict:
+    """Batched quote request plus per-ticker fallback (see fetch_quotes)."""
+    print(f"  Fetching quotes for {', '.join(tickers)}...", end=" ", flush=True)
+    try:
+        # Plain requests sessions get 401 here: yfinance adds the crumb
+        with _limiter.ratelimit('yahoo', delay=True):
+            data = YfData().get_raw_json(
+                YAHOO_QUOTE_URL,
+                params={
+                    'symbols': ",".join(tickers),
+                    'fields': ",".join(YAHOO_QUOTE_FIELDS),
+                    'formatted': 'false'
+                }
+            )
+        entries = data['quoteResponse']['result']
+        print("✓")
+    except Exception as e:
+        print(f"✗ Error: {e}")
+        entries = []
+
+    by_symbol = {entry.get('symbol', '').upper(): entry for entry in entries}
+
+    results = {}
+    missing = []
+    for t in tickers:
+        entry = by_symbol.get(t.upper())
+        if entry is None or any(entry.get(f) is None for f in _REQUIRED_QUOTE_FIELDS):
+            missing.append(t)
+        else:
+            results[t] = _parse_ticker_info(t, entry)
+
+    if missing:
+        # Per-ticker lookups are I/O-bound, so run them concurrently
+        print(f"  Fetching {', '.join(missing)} individually...")
+        with ThreadPoolExecutor(max_workers=min(len(missing), _MAX_FETCH_WORKERS)) as executor:
+            results.update(zip(missing, executor.map(_fetch_ticker_data, missing)))
+
+    return results
+
+
+def _fetch_ticker_data(ticker: str) -> dict:
+    """
+    Fetch and parse metrics for a single ticker via yfinance.
+    Throttled by the shared limiter; retries a 429 with a short backoff.
+
+    Args:
+        ticker: Stock ticker symbol
+
+    Returns:
+        Dictionary with price, market_cap, pe, peg, pb (empty data on error)
+    """
+    for attempt in range(_RATE_LIMIT_RETRIES + 1):
+        try:
+            # Let yfinance handle its own session (it rejects plain requests sessions)
+            with _limiter.ratelimit('yahoo', delay=True):
+                info = yf.Ticker(ticker).info
+            return _parse_ticker_info(ticker, info)
+        except Exception as e:
+            if attempt < _RATE_LIMIT_RETRIES and ("429" in str(e) or "Too Many Requests" in str(e)):
+                wait = _RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt
+                print(f"  ⚠️  Rate limited on {ticker}. Waiting {wait} seconds...")
+                time.sleep(wait)
+                continue
+            print(f"  ✗ {ticker}: {e}")
+            return _get_empty_ticker_data(ticker)
+
+
 def _parse_ticker_info(ticker: str, info: dict) -> dict:
     """
-    Parse yfinance info dict into our standard format.
+    Parse a yfinance info dict or Yahoo quote entry into our standard format.
 
     Args:
         ticker: Stock ticker symbol
-        info: yfinance info dictionary
+        info: yfinance info dictionary or quoteResponse result entry
 
     Returns:
         Dictionary with price, market_cap, pe, peg, pb
@@ -165,7 +380,7 @@ def _parse_ticker_info(ticker: str, info: dict) -> dict:
     # Get key metrics (handle None values)
     market_cap = info.get('marketCap', 0)
     pe_ratio = info.get('trailingPE') or info.get('forwardPE')
-    peg_ratio = info.get('pegRatio')
+    peg_ratio = info.get('pegRatio') or info.get('trailingPegRatio') or _forward_peg(info)
     pb_ratio = info.get('priceToBook')
 
     return {
@@ -178,6 +393,29 @@ def _parse_ticker_info(ticker: str, info: dict) -> dict:
     }
 
 
+def _forward_peg(info: dict) -> float | None:
+    """
+    Estimate PEG from trailing P/E and forward EPS growth.
+
+    Used when Yahoo does not report a PEG ratio (the batched quote endpoint
+    never does). Growth is the expected change from trailing to forward EPS.
+
+    Args:
+        info: yfinance info dictionary or quoteResponse result entry
+
+    Returns:
+        PEG estimate, or None if earnings or growth are missing or non-positive
+    """
+    pe_ratio = info.get('trailingPE')
+    eps_ttm = info.get('epsTrailingTwelveMonths')
+    eps_forward = info.get('epsForward')
+    if not (pe_ratio and eps_ttm and eps_forward) or eps_ttm <= 0:
+        return None
+
+    growth_pct = (eps_forward / eps_ttm - 1) * 100
+    return pe_ratio / growth_pct if growth_pct > 0 else None
+
+
 def _get_empty_ticker_data(ticker: str) -> dict:
     """Return empty ticker data structure for error cases."""
     return {
@@ -191,6 +429,53 @@ def _get_empty_ticker_data(ticker: str) -> dict:
     }
 
 
+def _peer_averages(peers: dict, metrics: tuple) -> list:
+    """
+    Average each metric across peers, ignoring missing values.
+
+    Args:
+        peers: Dictionary of peer_ticker -> metrics
+        metrics: Metric keys to average (e.g., ('pe', 'peg', 'pb'))
+
+    Returns:
+        List of averages in the order of metrics (None where no peer has data)
+    """
+    arr = np.array(
+        [[np.nan if p[m] is None else p[m] for m in metrics] for p in peers.values()],
+        dtype=np.float64
+    ).reshape(-1, len(metrics))
+
+    counts = np.count_nonzero(~np.isnan(arr), axis=0)
+    sums = np.nansum(arr, axis=0)
+
+    return [float(s / c) if c else None for s, c in zip(sums, counts)]
+
+
+def _fmt_metric(label: str, ticker: str, value, avg) -> str:
+    """
+    Format one valuation metric block of the peer comparison summary.
+
+    Args:
+        label: Metric name (e.g., 'P/E Ratio')
+        ticker: Main stock ticker symbol
+        value: Main ticker's value for the metric (None if unavailable)
+        avg: Peer average for the metric (None if unavailable)
+
+    Returns:
+        Block of lines ending with a blank line
+    """
+    if not (value and avg):
+        return f"{label}: Data not available\n"
+
+    diff = ((value - avg) / avg) * 100
+    return (
+        f"{label}:\n"
+        f"  {ticker}: {value}\n"
+        f"  Peer Avg: {avg:.2f}\n"
+        f"  Difference: {diff:+.1f}% {'(PREMIUM)' if diff > 0 else '(DISCOUNT)'}\n"
+    )
+
+
 def calculate_peer_comparison(ticker: str, market_data: dict) -> str:
     """
     Calculate how the main ticker compares to peer group averages.
@@ -206,67 +491,27 @@ def calculate_peer_comparison(ticker: str, market_data: dict) -> str:
     peers = market_data['peers']
     peer_list = market_data['peer_list']
 
-    # Calculate peer averages (excluding None values)
-    pe_values = [p['pe'] for p in peers.values() if p['pe'] is not None]
-    peg_values = [p['peg'] for p in peers.values() if p['peg'] is not None]
-    pb_values = [p['pb'] for p in peers.values() if p['pb'] is not None]
-
-    avg_pe = sum(pe_values) / len(pe_values) if pe_values else None
-    avg_peg = sum(peg_values) / len(peg_values) if peg_values else None
-    avg_pb = sum(pb_values) / len(pb_values) if pb_values else None
+    # Calculate peer averages in one pass (missing values are NaN and excluded)
+    avg_pe, avg_peg, avg_pb = _peer_averages(peers, ('pe', 'peg', 'pb'))
 
     # Build comparison summary
     summary_lines = [
-        f"=" * 60,
+        _BAR,
         f"PEER COMPARISON ANALYSIS FOR {ticker}",
-        f"=" * 60,
-        f"",
+        _BAR,
+        "",
         f"Main Ticker: {ticker}",
         f"Price: ${main['price']}",
         f"Market Cap: ${main['market_cap']:,}",
-        f"",
+        "",
         f"Peer Group: {', '.join(peer_list)}",
-        f"",
-        f"--- VALUATION METRICS ---",
-        f""
+        "",
+        "--- VALUATION METRICS ---",
+        "",
+        _fmt_metric("P/E Ratio", ticker, main['pe'], avg_pe),
+        _fmt_metric("PEG Ratio", ticker, main['peg'], avg_peg),
+        _fmt_metric("Price-to-Book Ratio", ticker, main['pb'], avg_pb),
+        _BAR
     ]
 
-    # P/E Comparison
-    if main['pe'] and avg_pe:
-        pe_diff = ((main['pe'] - avg_pe) / avg_pe) * 100
-        summary_lines.append(f"P/E Ratio:")
-        summary_lines.append(f"  {ticker}: {main['pe']}")
-        summary_lines.append(f"  Peer Avg: {avg_pe:.2f}")
-        summary_lines.append(f"  Difference: {pe_diff:+.1f}% {'(PREMIUM)' if pe_diff > 0 else '(DISCOUNT)'}")
-        summary_lines.append(f"")
-    else:
-        summary_lines.append(f"P/E Ratio: Data not available")
-        summary_lines.append(f"")
-
-    # PEG Comparison
-    if main['peg'] and avg_peg:
-        peg_diff = ((main['peg'] - avg_peg) / avg_peg) * 100
-        summary_lines.append(f"PEG Ratio:")
-        summary_lines.append(f"  {ticker}: {main['peg']}")
-        summary_lines.append(f"  Peer Avg: {avg_peg:.2f}")
-        summary_lines.append(f"  Difference: {peg_diff:+.1f}% {'(PREMIUM)' if peg_diff > 0 else '(DISCOUNT)'}")
-        summary_lines.append(f"")
-    else:
-        summary_lines.append(f"PEG Ratio: Data not available")
-        summary_lines.append(f"")
-
-    # P/B Comparison
-    if main['pb'] and avg_pb:
-        pb_diff = ((main['pb'] - avg_pb) / avg_pb) * 100
-        summary_lines.append(f"Price-to-Book Ratio:")
-        summary_lines.append(f"  {ticker}: {main['pb']}")
-        summary_lines.append(f"  Peer Avg: {avg_pb:.2f}")
-        summary_lines.append(f"  Difference: {pb_diff:+.1f}% {'(PREMIUM)' if pb_diff > 0 else '(DISCOUNT)'}")
-        summary_lines.append(f"")
-    else:
-        summary_lines.append(f"Price-to-Book Ratio: Data not available")
-        summary_lines.append(f"")
-
-    summary_lines.append(f"=" * 60)
-
     return "\n".join(summary_lines)
@@ -3,19 +3,41 @@ Main orchestration file for the Equity Research Agent system.
 Implements the parallel multi-agent architecture using LangGraph.
 """
 
+import asyncio
+import re
+
 from langgraph.graph import StateGraph, END
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 
 from agents import (
     AgentState,
+    InvestmentMemo,
+    render_memo,
     FUNDAMENTALIST_PROMPT,
     QUANT_PROMPT,
-    STRATEGIST_PROMPT
+    STRATEGIST_PROMPT,
+    COMBINED_PROMPT,
+    FUNDAMENTALIST_TEMPLATE,
+    QUANT_TEMPLATE,
+    STRATEGIST_TEMPLATE,
+    COMBINED_TEMPLATE
 )
-from data_tools import fetch_market_data, calculate_peer_comparison
+from config import FUSE_ANALYST_CALLS, PORTFOLIO_BIN_MAX_TOKENS, STRUCTURED_MEMO
+from data_tools import fetch_market_data, fetch_quotes, calculate_peer_comparison
 from utils import get_llm
 
 
+# Nodes whose LLM tokens are streamed to the terminal as they are generated
+# (a structured memo is JSON on the wire, so it is printed once rendered instead)
+_STREAMED_NODES = ('combined',) if STRUCTURED_MEMO else ('strategist', 'combined')
+
+# Section headers emitted by the combined node's single generation
+_SECTION_RE = re.compile(r"^###\s*(FUNDAMENTAL|QUANT|MEMO)\s*$", re.MULTILINE)
+# A complete MEMO header line: the combined node is streamed from here on
+_MEMO_HEADER_RE = re.compile(r"^###[ \t]*MEMO[ \t]*\n", re.MULTILINE)
+
+
 # ============================================================================
 # NODE DEFINITIONS
 # ============================================================================
@@ -45,31 +67,34 @@ def research_node(state: AgentState) -> AgentState:
     return {'market_data': comparison}
 
 
-def fundamentalist_node(state: AgentState) -> AgentState:
+async def fundamentalist_node(state: AgentState, config: RunnableConfig) -> AgentState:
     """
     Run fundamental analysis using the fundamentalist agent.
 
     Args:
         state: Current agent state
+        config: Run config (may carry a max_tokens cap, see _max_tokens)
 
     Returns:
         Updated state with fundamentalist_analysis populated
     """
     print(f"\n[Fundamentalist Agent] Analyzing {state['ticker']}...")
 
-    llm = get_llm()
+    llm = get_llm(max_tokens=_max_tokens(config))
 
-    # Construct the prompt
-    prompt = f"""{FUNDAMENTALIST_PROMPT}
+    # Fill the per-call template (static system prompt first so its prefix is cacheable)
+    prompt = FUNDAMENTALIST_TEMPLATE.format(
+        ticker=state['ticker'],
+        market_data=state['market_data']
+    )
 
-Here is the market data for {state['ticker']}:
+    messages = [
+        SystemMessage(content=FUNDAMENTALIST_PROMPT),
+        HumanMessage(content=prompt)
+    ]
 
-{state['market_data']}
-
-Provide your fundamental analysis:"""
-
-    # Invoke LLM
-    response = llm.invoke([HumanMessage(content=prompt)])
+    # Invoke LLM (async so parallel branches overlap)
+    response = await llm.ainvoke(messages)
 
     # Return only the updated field
     print(f"[Fundamentalist Agent] Analysis complete")
@@ -77,31 +102,34 @@ Provide your fundamental analysis:"""
     return {'fundamentalist_analysis': response.content}
 
 
-def quant_node(state: AgentState) -> AgentState:
+async def quant_node(state: AgentState, config: RunnableConfig) -> AgentState:
     """
     Run quantitative analysis using the quant agent.
 
     Args:
         state: Current agent state
+        config: Run config (may carry a max_tokens cap, see _max_tokens)
 
     Returns:
         Updated state with quant_analysis populated
     """
     print(f"\n[Quant Agent] Analyzing {state['ticker']}...")
 
-    llm = get_llm()
+    llm = get_llm(max_tokens=_max_tokens(config))
 
-    # Construct the prompt
-    prompt = f"""{QUANT_PROMPT}
+    # Fill the per-call template (static system prompt first so its prefix is cacheable)
+    prompt = QUANT_TEMPLATE.format(
+        ticker=state['ticker'],
+        market_data=state['market_data']
+    )
 
-Here is the peer comparison data for {state['ticker']}:
+    messages = [
+        SystemMessage(content=QUANT_PROMPT),
+        HumanMessage(content=prompt)
+    ]
 
-{state['market_data']}
-
-Provide your quantitative analysis:"""
-
-    # Invoke LLM
-    response = llm.invoke([HumanMessage(content=prompt)])
+    # Invoke LLM (async so parallel branches overlap)
+    response = await llm.ainvoke(messages)
 
     # Return only the updated field
     print(f"[Quant Agent] Analysis complete")
@@ -109,37 +137,44 @@ Provide your quantitative analysis:"""
     return {'quant_analysis': response.content}
 
 
-def strategist_node(state: AgentState) -> AgentState:
+async def strategist_node(state: AgentState, config: RunnableConfig) -> AgentState:
     """
     Synthesize analyses and produce final investment recommendation.
 
     Args:
         state: Current agent state
+        config: Run config (may carry a max_tokens cap, see _max_tokens)
 
     Returns:
-        Updated state with final_report populated
+        Updated state with final_report (and memo, if STRUCTURED_MEMO) populated
     """
     print(f"\n[Strategist Agent] Synthesizing final report for {state['ticker']}...")
 
-    llm = get_llm()
+    llm = get_llm(max_tokens=_max_tokens(config))
 
-    # Construct the prompt
-    prompt = f"""{STRATEGIST_PROMPT}
+    # Fill the per-call template (static system prompt first so its prefix is cacheable)
+    prompt = STRATEGIST_TEMPLATE.format(
+        ticker=state['ticker'],
+        fundamentalist_analysis=state['fundamentalist_analysis'],
+        quant_analysis=state['quant_analysis']
+    )
 
-You are analyzing: {state['ticker']}
+    messages = [
+        SystemMessage(content=STRATEGIST_PROMPT),
+        HumanMessage(content=prompt)
+    ]
 
-=== FUNDAMENTAL ANALYST'S REPORT ===
-{state['fundamentalist_analysis']}
+    if STRUCTURED_MEMO:
+        # Schema-guided decoding: the response is always a valid InvestmentMemo
+        memo = await llm.with_structured_output(InvestmentMemo).ainvoke(messages)
+        memo = memo.model_dump()
 
-=== QUANTITATIVE ANALYST'S REPORT ===
-{state['quant_analysis']}
+        print(f"[Strategist Agent] Final report complete")
 
-=== YOUR TASK ===
-Synthesize the above analyses into a final investment memo with a clear BUY/SELL/HOLD recommendation.
-"""
+        return {'memo': memo, 'final_report': render_memo(memo)}
 
     # Invoke LLM
-    response = llm.invoke([HumanMessage(content=prompt)])
+    response = await llm.ainvoke(messages)
 
     # Return only the updated field
     print(f"[Strategist Agent] Final report complete")
@@ -147,6 +182,73 @@ Synthesize the above analyses into a final investment memo with a clear BUY/SELL
     return {'final_report': response.content}
 
 
+async def combined_node(state: AgentState, config: RunnableConfig) -> AgentState:
+    """
+    Run all three analyst roles in a single LLM call.
+
+    The market data is sent once and the model writes the fundamental,
+    quant and memo sections in one generation, which are then split back
+    into their state fields.
+
+    Args:
+        state: Current agent state
+        config: Run config (may carry a max_tokens cap, see _max_tokens)
+
+    Returns:
+        Updated state with fundamentalist_analysis, quant_analysis and
+        final_report populated
+    """
+    print(f"\n[Combined Agent] Analyzing {state['ticker']}...")
+
+    llm = get_llm(max_tokens=_max_tokens(config))
+
+    # Fill the per-call template (static system prompt first so its prefix is cacheable)
+    prompt = COMBINED_TEMPLATE.format(
+        ticker=state['ticker'],
+        market_data=state['market_data']
+    )
+
+    messages = [
+        SystemMessage(content=COMBINED_PROMPT),
+        HumanMessage(content=prompt)
+    ]
+
+    # Invoke LLM
+    response = await llm.ainvoke(messages)
+
+    sections = _split_sections(response.content)
+
+    # Return only the updated fields
+    print(f"[Combined Agent] Analysis complete")
+
+    return {
+        'fundamentalist_analysis': sections.get('FUNDAMENTAL', ''),
+        'quant_analysis': sections.get('QUANT', ''),
+        # Fall back to the raw response if the model ignored the headers
+        'final_report': sections.get('MEMO') or response.content
+    }
+
+
+def _max_tokens(config: RunnableConfig) -> int | None:
+    """Read the per-run generation cap set by analyze_tickers (None = no cap)."""
+    return (config or {}).get('configurable', {}).get('max_tokens')
+
+
+def _split_sections(text: str) -> dict:
+    """
+    Split a combined response into its ### FUNDAMENTAL / QUANT / MEMO sections.
+
+    Args:
+        text: Raw LLM response content
+
+    Returns:
+        Dictionary of section name -> stripped section body
+    """
+    parts = _SECTION_RE.split(text)
+    # parts = [preamble, name1, body1, name2, body2, ...]
+    return {name: body.strip() for name, body in zip(parts[1::2], parts[2::2])}
+
+
 # ============================================================================
 # GRAPH CONSTRUCTION
 # ============================================================================
@@ -155,12 +257,33 @@ def create_graph():
     """
     Create the LangGraph workflow with parallel agent execution.
 
+    If FUSE_ANALYST_CALLS is set, the three analyst nodes are replaced by
+    a single combined node (research -> combined -> END).
+
     Returns:
         Compiled graph ready for execution
+
+    Raises:
+        ValueError: If FUSE_ANALYST_CALLS and STRUCTURED_MEMO are both set
+            (the combined node only produces a free-form memo)
     """
+    if FUSE_ANALYST_CALLS and STRUCTURED_MEMO:
+        raise ValueError(
+            "FUSE_ANALYST_CALLS and STRUCTURED_MEMO cannot both be enabled: "
+            "the combined node does not produce a structured memo"
+        )
+
     # Initialize graph
     workflow = StateGraph(AgentState)
 
+    if FUSE_ANALYST_CALLS:
+        workflow.add_node("research", research_node)
+        workflow.add_node("combined", combined_node)
+        workflow.set_entry_point("research")
+        workflow.add_edge("research", "combined")
+        workflow.add_edge("combined", END)
+        return workflow.compile()
+
     # Add nodes
     workflow.add_node("research", research_node)
     workflow.add_node("fundamentalist", fundamentalist_node)
@@ -186,14 +309,184 @@ def create_graph():
     return workflow.compile()
 
 
+_GRAPH = None
+
+
+def get_graph():
+    """
+    Get the compiled graph, compiling it on first use.
+
+    Returns:
+        Compiled graph shared by all invocations
+    """
+    global _GRAPH
+    if _GRAPH is None:
+        _GRAPH = create_graph()
+    return _GRAPH
+
+
 # ============================================================================
 # CLI RUNNER
 # ============================================================================
 
+def _initial_state(ticker: str) -> AgentState:
+    """Build an empty agent state for a ticker."""
+    return {
+        'ticker': ticker,
+        'market_data': '',
+        'fundamentalist_analysis': '',
+        'quant_analysis': '',
+        'final_report': '',
+        'memo': {}
+    }
+
+
+async def analyze_tickers(graph, tickers: list[str], max_tokens: int | None = None) -> list:
+    """
+    Run the graph for several tickers concurrently.
+
+    Concurrent requests let a batching backend (e.g. vLLM) interleave them
+    instead of serving one analysis at a time.
+
+    Args:
+        graph: Compiled graph from create_graph()
+        tickers: Ticker symbols to analyze
+        max_tokens: Optional cap on tokens generated by each LLM call
+
+    Returns:
+        Final state for each ticker, or the exception raised for it
+    """
+    config = {'configurable': {'max_tokens': max_tokens}}
+    return await asyncio.gather(
+        *(graph.ainvoke(_initial_state(t), config=config) for t in tickers),
+        return_exceptions=True
+    )
+
+
+def _bin_by_market_cap(market_caps: dict, n_bins: int) -> list[list[str]]:
+    """
+    Split tickers into n_bins groups of similar market cap.
+
+    Args:
+        market_caps: Dictionary of ticker -> market cap (0 if unknown)
+        n_bins: Number of bins
+
+    Returns:
+        List of n_bins ticker lists, smallest caps first (some may be empty)
+    """
+    ordered = sorted(market_caps, key=lambda t: market_caps[t] or 0)
+    n = len(ordered)
+    # Integer bounds put any remainder in the larger-cap bins
+    return [ordered[i * n // n_bins:(i + 1) * n // n_bins] for i in range(n_bins)]
+
+
+async def analyze_portfolio(graph, tickers: list[str]) -> dict:
+    """
+    Analyze a portfolio of tickers in market-cap bins.
+
+    Large caps tend to produce longer memos, so tickers are grouped by
+    market cap (one batched quote request) and each bin runs as its own
+    concurrent round with the matching PORTFOLIO_BIN_MAX_TOKENS cap. Short
+    analyses then finish together instead of waiting behind long ones.
+
+    Portfolios too small to fill every bin with at least two tickers run as
+    a single concurrent round, since serial bins would only add latency.
+    The quotes fetched for binning are cached, so the research nodes reuse
+    them for the main tickers.
+
+    Args:
+        graph: Compiled graph from create_graph()
+        tickers: Ticker symbols to analyze
+
+    Returns:
+        Dictionary of ticker -> final state, or the exception raised for it
+    """
+    n_bins = len(PORTFOLIO_BIN_MAX_TOKENS)
+    if len(tickers) < 2 * n_bins:
+        return dict(zip(tickers, await analyze_tickers(graph, tickers)))
+
+    quotes = await asyncio.to_thread(fetch_quotes, tickers)
+    market_caps = {t: quotes[t]['market_cap'] for t in tickers}
+    bins = _bin_by_market_cap(market_caps, n_bins)
+
+    results = {}
+    for bin_tickers, max_tokens in zip(bins, PORTFOLIO_BIN_MAX_TOKENS):
+        if not bin_tickers:
+            continue
+        print(f"\n📦 Batch ({max_tokens} max tokens): {', '.join(bin_tickers)}")
+        final_states = await analyze_tickers(graph, bin_tickers, max_tokens=max_tokens)
+        results.update(zip(bin_tickers, final_states))
+    return results
+
+
+async def stream_analysis(graph, ticker: str) -> dict:
+    """
+    Run the graph for one ticker, printing the memo tokens as they arrive.
+
+    The memo nodes still call llm.ainvoke; astream_events surfaces their
+    token chunks through LangChain callbacks. The combined node's output is
+    held back until its MEMO header, so the analyst sections are not shown
+    under the memo banner. If nothing streams (the backend does not stream,
+    or the model ignored the headers), the memo is printed once the graph
+    finishes.
+
+    Args:
+        graph: Compiled graph from create_graph()
+        ticker: Ticker symbol to analyze
+
+    Returns:
+        Final agent state
+    """
+    final_state = None
+    streamed = False
+    # Combined-node text received before its MEMO header
+    preamble = ""
+
+    async for event in graph.astream_events(_initial_state(ticker), version="v2"):
+        kind = event['event']
+        node = event.get('metadata', {}).get('langgraph_node')
+
+        if kind == 'on_chat_model_stream' and node in _STREAMED_NODES:
+            text = event['data']['chunk'].content
+            if node == 'combined' and not streamed:
+                preamble += text
+                match = _MEMO_HEADER_RE.search(preamble)
+                if not match:
+                    continue
+                text = preamble[match.end():].lstrip()
+            if not streamed:
+                print("\n" + "=" * 70)
+                print(f"📊 FINAL INVESTMENT MEMO: {ticker}")
+                print("=" * 70 + "\n")
+                streamed = True
+            print(text, end="", flush=True)
+        elif kind == 'on_chat_model_end' and node in _STREAMED_NODES and streamed:
+            print("\n\n" + "=" * 70)
+        elif kind == 'on_chain_end' and not event.get('parent_ids'):
+            # Root graph run finished: its output is the final state
+            final_state = event['data']['output']
+
+    if not streamed:
+        _print_report(ticker, final_state)
+    return final_state
+
+
+def _print_report(ticker: str, final_state: dict):
+    """Print the final investment memo for a ticker."""
+    print("\n" + "=" * 70)
+    print(f"📊 FINAL INVESTMENT MEMO: {ticker}")
+    print("=" * 70)
+    print(f"\n{final_state['final_report']}")
+    print("\n" + "=" * 70)
+
+
 def run_analysis():
     """
     Interactive CLI for running stock analyses.
     Loops continuously until user exits.
+    Accepts a single ticker or a comma-separated portfolio analyzed concurrently
+    in market-cap bins.
+    A single ticker's memo is streamed to the terminal as it is generated.
     """
     print("=" * 70)
     print("🔬 ALGORITHMIC EQUITY RESEARCH AGENT")
@@ -204,50 +497,53 @@ def run_analysis():
     print("- Strategist: Synthesized investment recommendation")
     print("\n" + "=" * 70)
 
-    # Create the graph once
-    graph = create_graph()
-
-    while True:
-        print("\n" + "-" * 70)
-        ticker = input("\nEnter stock ticker (or 'quit' to exit): ").strip().upper()
-
-        if ticker in ['QUIT', 'EXIT', 'Q']:
-            print("\n👋 Goodbye!")
-            break
-
-        if not ticker:
-            print("⚠️  Please enter a valid ticker symbol")
-            continue
-
-        try:
-            # Initialize state
-            initial_state = {
-                'ticker': ticker,
-                'market_data': '',
-                'fundamentalist_analysis': '',
-                'quant_analysis': '',
-                'final_report': ''
-            }
-
-            # Run the graph
-            print(f"\n🚀 Starting analysis for {ticker}...")
-            print("=" * 70)
-
-            final_state = graph.invoke(initial_state)
-
-            # Display final report
-            print("\n" + "=" * 70)
-            print("📊 FINAL INVESTMENT MEMO")
-            print("=" * 70)
-            print(f"\n{final_state['final_report']}")
-            print("\n" + "=" * 70)
-
-        except KeyboardInterrupt:
-            print("\n\n⚠️  Analysis interrupted by user")
-            break
-        except Exception as e:
-            print(f"\n❌ Error during analysis: {e}")
-            print("Please try again with a different ticker")
+    # Compile the graph once and reuse it for every analysis
+    graph = get_graph()
+
+    # One event loop for the whole session: the cached LLM clients hold async
+    # connection pools bound to the loop they were first used on
+    with asyncio.Runner() as runner:
+        while True:
+            print("\n" + "-" * 70)
+            raw = input("\nEnter stock ticker(s), comma-separated (or 'quit' to exit): ").strip().upper()
+
+            if raw in ['QUIT', 'EXIT', 'Q']:
+                print("\n👋 Goodbye!")
+                break
+
+            # Deduplicate while preserving order
+            tickers = list(dict.fromkeys(t.strip() for t in raw.split(',') if t.strip()))
+
+            if not tickers:
+                print("⚠️  Please enter a valid ticker symbol")
+                continue
+
+            try:
+                # Run the graph
+                print(f"\n🚀 Starting analysis for {', '.join(tickers)}...")
+                print("=" * 70)
+
+                if len(tickers) == 1:
+                    # Stream the memo as it is generated
+                    runner.run(stream_analysis(graph, tickers[0]))
+                else:
+                    # Portfolio mode: market-cap bins, each run as one concurrent batch
+                    final_states = runner.run(analyze_portfolio(graph, tickers))
+
+                    # Display final reports
+                    for ticker in tickers:
+                        final_state = final_states[ticker]
+                        if isinstance(final_state, Exception):
+                            print(f"\n❌ Error during analysis of {ticker}: {final_state}")
+                            continue
+                        _print_report(ticker, final_state)
+
+            except KeyboardInterrupt:
+                print("\n\n⚠️  Analysis interrupted by user")
+                break
+            except Exception as e:
+                print(f"\n❌ Error during analysis: {e}")
+                print("Please try again with a different ticker")
 
 
 # ============================================================================
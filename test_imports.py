@@ -117,6 +117,130 @@ def test_peer_comparison_calculation():
         return False
 
 
+def test_quote_parsing():
+    """Test parsing a batched quote entry (no PEG field) without network calls."""
+    print("\nTesting quote entry parsing...")
+
+    try:
+        from data_tools import _parse_ticker_info
+
+        entry = {
+            'symbol': 'AAPL',
+            'regularMarketPrice': 150.0,
+            'marketCap': 2500000000000,
+            'trailingPE': 30.0,
+            'priceToBook': 40.0,
+            'epsTrailingTwelveMonths': 5.0,
+            'epsForward': 6.0
+        }
+        data = _parse_ticker_info('AAPL', entry)
+        assert data['price'] == 150.0
+        assert data['peg'] == 1.5  # 30 P/E / 20% forward EPS growth
+        assert _parse_ticker_info('AAPL', {**entry, 'epsForward': 4.0})['peg'] is None
+        print("✓ Quote entry parsed successfully")
+
+        return True
+    except Exception as e:
+        print(f"✗ Quote parsing error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_peer_parsing():
+    """Test parsing of LLM peer responses without calling the LLM."""
+    print("\nTesting peer response parsing...")
+
+    try:
+        from data_tools import _parse_peers, _guess_peers
+
+        assert _parse_peers('["MSFT", "GOOGL", "META"]') == ['MSFT', 'GOOGL', 'META']
+        assert _parse_peers("['msft', 'googl', 'meta']") == ['MSFT', 'GOOGL', 'META']
+        assert _parse_peers('{"peers": ["MSFT", "GOOGL", "META"]}') == ['MSFT', 'GOOGL', 'META']
+        assert _parse_peers('{"peers": ["AAPL", "GOOGL", "META"]}', exclude='AAPL') is None
+        assert _parse_peers('{"peers": ["MSFT", "MSFT", "META"]}') is None
+        assert _parse_peers('{"peers": ["Microsoft", "", "META"]}') is None
+        assert _parse_peers("Peers for AAPL: MSFT, GOOGL, META") is None
+        assert _guess_peers("Peers for AAPL: MSFT, GOOGL, META", exclude='AAPL') == ['MSFT', 'GOOGL', 'META']
+        assert _guess_peers("I am not sure") is None
+        print("✓ Peer responses parsed successfully")
+
+        return True
+    except Exception as e:
+        print(f"✗ Peer parsing error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_combined_section_split():
+    """Test splitting a combined analyst response into sections."""
+    print("\nTesting combined response splitting...")
+
+    try:
+        from main import _split_sections
+
+        text = "### FUNDAMENTAL\nCheap.\n\n### QUANT\nDiscount of 10%.\n\n### MEMO\n**BUY**"
+        sections = _split_sections(text)
+        assert sections == {'FUNDAMENTAL': 'Cheap.', 'QUANT': 'Discount of 10%.', 'MEMO': '**BUY**'}
+        assert _split_sections("no headers here") == {}
+        print("✓ Combined response split successfully")
+
+        return True
+    except Exception as e:
+        print(f"✗ Section split error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_portfolio_binning():
+    """Test grouping portfolio tickers by market cap."""
+    print("\nTesting portfolio market-cap binning...")
+
+    try:
+        from main import _bin_by_market_cap
+
+        caps = {'AAPL': 3000, 'F': 50, 'DIS': 200, 'XYZ': 0, 'KO': 260, 'T': 120, 'GM': 55}
+        assert _bin_by_market_cap(caps, 3) == [['XYZ', 'F'], ['GM', 'T'], ['DIS', 'KO', 'AAPL']]
+        print("✓ Portfolio binned successfully")
+
+        return True
+    except Exception as e:
+        print(f"✗ Portfolio binning error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_memo_rendering():
+    """Test rendering a structured investment memo."""
+    print("\nTesting structured memo rendering...")
+
+    try:
+        from agents import InvestmentMemo, render_memo
+
+        memo = InvestmentMemo(
+            executive_summary="Strong franchise at a premium valuation.",
+            evidence=["Peer-leading margins", "Consistent buybacks"],
+            risks=["P/E 20% above peers"],
+            recommendation="HOLD",
+            conviction="Medium"
+        )
+        report = render_memo(memo.model_dump())
+        assert "- Peer-leading margins" in report
+        assert "Recommendation: **HOLD**" in report
+        assert "Conviction: Medium" in report
+        print("✓ Structured memo rendered successfully")
+
+        return True
+    except Exception as e:
+        print(f"✗ Memo rendering error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def test_graph_structure():
     """Test that the graph can be created (without executing)."""
     print("\nTesting graph structure...")
@@ -148,6 +272,11 @@ if __name__ == "__main__":
     all_passed &= test_imports()
     all_passed &= test_data_fetch()
     all_passed &= test_peer_comparison_calculation()
+    all_passed &= test_quote_parsing()
+    all_passed &= test_peer_parsing()
+    all_passed &= test_combined_section_split()
+    all_passed &= test_portfolio_binning()
+    all_passed &= test_memo_rendering()
     all_passed &= test_graph_structure()
 
     print("\n" + "=" * 70)
@@ -2,38 +2,117 @@
 Utility functions for the Equity Research Agent system.
 """
 
+from functools import lru_cache
+
 from langchain_ollama import ChatOllama
 from langchain_openai import ChatOpenAI
 from config import (
     LLM_MODEL,
     OPENAI_MODEL,
     OPENAI_TEMPERATURE,
+    OPENAI_PEERS_MODEL,
     OLLAMA_MODEL,
-    OLLAMA_TEMPERATURE
+    OLLAMA_TEMPERATURE,
+    OLLAMA_PEERS_MODEL,
+    VLLM_BASE_URL,
+    VLLM_MODEL,
+    VLLM_TEMPERATURE
 )
 
 
-def get_llm():
+# JSON schema for the peer-selection response: exactly 3 ticker strings.
+# Wrapped in an object because OpenAI structured outputs require one at the top level.
+PEERS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "peers": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 3,
+            "maxItems": 3
+        }
+    },
+    "required": ["peers"],
+    "additionalProperties": False
+}
+
+# OpenAI-style structured output request, also accepted by vLLM's OpenAI server
+PEERS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "peers",
+        "schema": PEERS_SCHEMA,
+        "strict": True
+    }
+}
+
+
+def get_llm(role: str = 'analyst', max_tokens: int | None = None):
     """
     Factory function to get the appropriate LLM based on configuration.
 
+    The instance is cached per (role, max_tokens) so every node shares one
+    client (and its connection pool), however the arguments are passed.
+    Call _build_llm.cache_clear() if the config changes.
+
+    Args:
+        role: 'analyst' for the analysis nodes, or 'peers' for the small
+            peer-selection model constrained to PEERS_SCHEMA output
+        max_tokens: Optional cap on generated tokens (None = backend default)
+
     Returns:
         ChatOllama or ChatOpenAI: Configured LLM instance
 
     Raises:
-        ValueError: If LLM_MODEL is not 'ollama' or 'openai'
+        ValueError: If LLM_MODEL is not 'ollama', 'openai' or 'vllm', or role is unknown
     """
+    # Normalise to positional args: lru_cache keys f(x) and f(role=x) differently
+    return _build_llm(role, max_tokens)
+
+
+@lru_cache(maxsize=None)
+def _build_llm(role: str, max_tokens: int | None):
+    """Build the LLM client for get_llm (cached on the normalised arguments)."""
+    if role not in ('analyst', 'peers'):
+        raise ValueError(f"Invalid role: {role}. Must be 'analyst' or 'peers'")
+
     if LLM_MODEL == 'ollama':
+        if role == 'peers':
+            return ChatOllama(
+                model=OLLAMA_PEERS_MODEL,
+                temperature=OLLAMA_TEMPERATURE,
+                format=PEERS_SCHEMA
+            )
         return ChatOllama(
             model=OLLAMA_MODEL,
-            temperature=OLLAMA_TEMPERATURE
+            temperature=OLLAMA_TEMPERATURE,
+            num_predict=max_tokens
         )
     elif LLM_MODEL == 'openai':
+        if role == 'peers':
+            return ChatOpenAI(
+                model=OPENAI_PEERS_MODEL,
+                temperature=OPENAI_TEMPERATURE,
+                model_kwargs={"response_format": PEERS_RESPONSE_FORMAT}
+            )
         return ChatOpenAI(
             model=OPENAI_MODEL,
-            temperature=OPENAI_TEMPERATURE
+            temperature=OPENAI_TEMPERATURE,
+            max_tokens=max_tokens
+        )
+    elif LLM_MODEL == 'vllm':
+        # vLLM serves one model; peer selection uses the same response_format as OpenAI
+        model_kwargs = {"response_format": PEERS_RESPONSE_FORMAT} if role == 'peers' else {}
+        return ChatOpenAI(
+            base_url=VLLM_BASE_URL,
+            api_key="EMPTY",
+            model=VLLM_MODEL,
+            temperature=VLLM_TEMPERATURE,
+            max_tokens=max_tokens,
+            model_kwargs=model_kwargs
         )
     else:
         raise ValueError(
-            f"Invalid LLM_MODEL: {LLM_MODEL}. Must be 'ollama' or 'openai'"
+            f"Invalid LLM_MODEL: {LLM_MODEL}. Must be 'ollama', 'openai' or 'vllm'"
         )
+